@@ -16,6 +16,9 @@ def main(
     predictions_key: str = typer.Option(..., help="Key in the input file for the model-generated summaries"),
     references_key: str = typer.Option(..., help="Key in the input file for the reference summaries"),
     batch_size: int = typer.Option(64, help="Batch size to use when computing BERTScore"),
+    mixed_precision: bool = typer.Option(
+        False, help="If True, compute BERTScore with bfloat16 mixed precision. Faster, but scores may differ slightly."
+    ),
 ) -> None:
     """Evaluate model-generated summaries against reference summaries using ROUGE and BERTScore."""
     results = json.loads(Path(input_fp).read_text().strip())
@@ -32,7 +35,7 @@ def main(
     print(f"[green]Done.[/green] ROUGE-Avg: {rouge_results['rouge_avg_fmeasure_mean']:.2f}")
     with Status("Computing BERTScore"):
         bertscore_results = metrics.compute_bertscore(
-            predictions=predictions, references=references, batch_size=batch_size
+            predictions=predictions, references=references, batch_size=batch_size, mixed_precision=mixed_precision
         )
     print(f"[green]Done.[/green] BERTScore F1: {bertscore_results['f1_mean']:.2f}")
 
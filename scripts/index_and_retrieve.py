@@ -1,11 +1,12 @@
-import copy
 from enum import Enum
 from functools import partial
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 
+import pandas as pd
 import pyterrier as pt
 import typer
+from datasets import DatasetDict
 from rich import print
 
 from open_mds import indexing
@@ -21,6 +22,10 @@ _NUM_RESULTS_PER_QUERY = 100
 # The default location to save document indices.
 _DOCUMENT_INDEX_DIR = Path(util.CACHE_DIR) / "indices"
 
+# The number of topics (queries) to pass to the retrieval pipeline at once. Larger values will increase the amount
+# of memory consumed (particularly the JVM heap for sparse retrieval), but reduce the per-batch overhead.
+_DEFAULT_BATCH_SIZE = 1024
+
 # The neural retirever to use for dense retireval pipeline. This could be made an argument to the script.
 _DEFAULT_NEURAL_RETRIEVER = "facebook/contriever-msmarco"
 
@@ -82,6 +87,27 @@ def main(
             " mean number of source documents across the examples of the dataset."
         ),
     ),
+    threads: int = typer.Option(
+        1,
+        help=(
+            "The number of threads to use when retrieving documents for a batch of topics. Only has an effect when"
+            " retriever is 'sparse'."
+        ),
+    ),
+    batch_size: int = typer.Option(
+        _DEFAULT_BATCH_SIZE,
+        help=(
+            "The number of topics to retrieve documents for at once. Lower this if you run out of memory (e.g. the"
+            " Java heap space) during retrieval."
+        ),
+    ),
+    num_proc: int = typer.Option(
+        None,
+        help=(
+            "The number of processes to use when re-building the dataset with the retrieved documents. Defaults to a"
+            " single process."
+        ),
+    ),
     splits: List[str] = typer.Option(
         None, help="Which splits of the dataset to replace with retrieved documents. Defaults to all splits."
     ),
@@ -96,9 +122,17 @@ def main(
         "--dry-run",
         help="Perform retrieval and report results without re-building the dataset. Useful for tuning and evaluation.",
     ),
+    report_metrics: Optional[bool] = typer.Option(
+        None,
+        "--report-metrics/--no-report-metrics",
+        help="Evaluate the retrieved results against the qrels. Defaults to True if --dry-run, else False.",
+    ),
 ) -> None:
     """Recreates the chosen HuggingFace dataset using the documents retrieved from an IR system."""
 
+    if report_metrics is None:
+        report_metrics = dry_run
+
     # Any dataset specific setup goes here
     if hf_dataset_name == Dataset.multinews:
         path = "multi_news"
@@ -125,18 +159,28 @@ def main(
     splits = splits or list(pt_dataset._hf_dataset.keys())
     print(f"[bold blue]:information: Will replace documents in {', '.join(splits)} splits")
 
-    # Create a new copy of the dataset and replace its source documents with retrieved documents
-    hf_dataset = copy.deepcopy(pt_dataset._hf_dataset)
+    # Create a new copy of the dataset and replace its source documents with retrieved documents. A shallow copy is
+    # sufficient, as each split we modify is re-assigned to the new dataset returned by `map`.
+    hf_dataset = DatasetDict(pt_dataset._hf_dataset)
     print(f"[bold green]:white_check_mark: Loaded the dataset from '{pt_dataset.info_url()}' [/bold green]")
 
     # Index the documents and load the retriever
     if retriever == Retriever.sparse:
-        indexref = pt_dataset.get_index(str(index_path), overwrite=overwrite_index, verbose=True)
+        # Build the index, if it doesn't already exist
+        pt_dataset.get_index(str(index_path), overwrite=overwrite_index, verbose=True)
         # In general, we should always load the actual index
         # See: https://pyterrier.readthedocs.io/en/latest/terrier-retrieval.html#index-like-objects
-        index = pt.IndexFactory.of(indexref)
+        index = indexing.load_index(str(index_path))
+        # Lucene-based toolkits (e.g. Pyserini) can be faster for BM25, but they need their own jars on the JVM
+        # classpath before the JVM starts. PyTerrier starts the JVM when open_mds.indexing is imported, so the two
+        # cannot be used in the same process. Use --threads to speed up Terrier's BM25 instead.
         retrieval_pipeline = pt.BatchRetrieve(
-            index, wmodel="BM25", metadata=["docno", "text"], num_results=_NUM_RESULTS_PER_QUERY, verbose=True
+            index,
+            wmodel="BM25",
+            metadata=["docno", "text"],
+            num_results=_NUM_RESULTS_PER_QUERY,
+            threads=threads,
+            verbose=True,
         )
     else:
         # Import here as PyTerrier will have been initialized by this point
@@ -182,35 +226,48 @@ def main(
             f"[bold]:magnifying_glass_tilted_right: Retrieving docs for each example in the '{split}' set... [/bold]"
         )
         topics = pt_dataset.get_topics(split)
-        qrels = pt_dataset.get_qrels(split)
-        retrieved = retrieval_pipeline.transform(topics)
+        # Retrieve in batches of topics to cap memory usage. Within a batch, sparse retrieval is multi-threaded.
+        # Slice topics positionally, as PyTerrier's transform_gen selects each batch's rows with a per-query filter,
+        # which is quadratic in the number of topics.
+        retrieved = pd.concat(
+            (retrieval_pipeline.transform(topics.iloc[i : i + batch_size]) for i in range(0, len(topics), batch_size)),
+            ignore_index=True,
+        )
 
-        eval_metrics = ["recall_100", "Rprec"]
-        if k is not None:
-            eval_metrics += [f"P_{k}", f"recall_{k}"]
+        # Evaluation is only used for reporting, so skip it by default when re-building the dataset
+        if report_metrics:
+            eval_metrics = ["recall_100", "Rprec"]
+            if k is not None:
+                eval_metrics += [f"P_{k}", f"recall_{k}"]
+            qrels = pt_dataset.get_qrels(split)
 
-        print(f"[bold]:test_tube: Evaluating retrieved results on the '{split}' set [/bold]")
-        print(
-            pt.Experiment(
-                [retrieved],
-                topics=topics,
-                qrels=qrels,
-                eval_metrics=eval_metrics,
-                names=[retriever.value],
-                save_dir=output_dir,
-                save_mode="overwrite",
-                round=4,
-                verbose=True,
+            print(f"[bold]:test_tube: Evaluating retrieved results on the '{split}' set [/bold]")
+            print(
+                pt.Experiment(
+                    # Retrieval has already been performed, so evaluate the results directly rather than re-running
+                    # the pipeline. The document text is not needed for evaluation, so drop it to avoid copying it.
+                    [retrieved.drop(columns=["text"], errors="ignore")],
+                    topics=topics,
+                    qrels=qrels,
+                    eval_metrics=eval_metrics,
+                    names=[retriever.value],
+                    save_dir=output_dir,
+                    save_mode="overwrite",
+                    round=4,
+                    verbose=True,
+                )
             )
-        )
 
         if dry_run:
             print("[bold yellow]:warning: --dry-run argument provided, dataset will not be re-built[/bold yellow]")
             continue
 
+        retrieved_by_qid = indexing.group_retrieved_by_qid(retrieved)
         hf_dataset[split] = hf_dataset[split].map(
-            partial(pt_dataset.replace, split=split, retrieved=retrieved, k=k),
+            partial(pt_dataset.replace_batched, split=split, retrieved=retrieved_by_qid, k=k),
             with_indices=True,
+            batched=True,
+            num_proc=num_proc,
             load_from_cache_file=not overwrite_cache,
             desc=f"Re-building {split} set",
         )
@@ -1,8 +1,10 @@
+import asyncio
 import datetime
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Optional
 
 import flatten_dict
 import tiktoken
@@ -23,13 +25,34 @@ from open_mds.common import util
 DOC_SEP_TOKEN = "\n\n"
 
 
-def _print_example_prompt(llm, example_prompt, example_printed: bool) -> bool:
+def _get_num_tokens(tokenizer: tiktoken.Encoding, text: str) -> int:
+    """Returns the number of tokens in `text`. Equivalent to `llm.get_num_tokens`, but calls tiktoken directly."""
+    return len(tokenizer.encode(text, disallowed_special=()))
+
+
+def _print_example_prompt(tokenizer: tiktoken.Encoding, example_prompt: str, example_printed: bool) -> bool:
     """Print the example prompt if it hasn't already been printed."""
     if not example_printed:
-        print(f"Example prompt (length={llm.get_num_tokens(example_prompt)}):\n\n{example_prompt}\n")
+        print(f"Example prompt (length={_get_num_tokens(tokenizer, example_prompt)}):\n\n{example_prompt}\n")
     return True
 
 
+async def _generate(chain: LLMChain, prompts: Dict[str, str], cache: Cache, concurrency: int) -> Dict[str, str]:
+    """Run `chain` on each of `prompts` (a dictionary mapping cache keys to input documents) concurrently, with at
+    most `concurrency` requests in flight at once. Each output is written to `cache` as soon as it is generated, so
+    an interrupted run can pick up where it left off."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _run(key: str, documents: str) -> str:
+        async with semaphore:
+            output = await chain.arun(documents=documents)
+        cache[key] = output
+        return output
+
+    outputs = await asyncio.gather(*(_run(key, documents) for key, documents in prompts.items()))
+    return dict(zip(prompts, outputs))
+
+
 def main(
     dataset_name: str = typer.Argument(..., help="The name of the dataset to use (via the datasets library)."),
     output_fp: str = typer.Argument(..., help="Filepath to save the results to."),
@@ -78,17 +101,25 @@ def main(
         ),
     ),
     do_eval: bool = typer.Option(False, help="If True, will evaluate the models outputs and save the results."),
+    mixed_precision: bool = typer.Option(
+        False, help="If True, compute BERTScore with bfloat16 mixed precision. Faster, but scores may differ slightly."
+    ),
     dry_run: bool = typer.Option(False, help="If True, run a single example, print a projected cost and exit."),
     use_cache: bool = typer.Option(
         True, help="If True, will load model generations from cache when model_name and prompt are identical."
     ),
+    concurrency: int = typer.Option(16, help="The maximum number of concurrent requests to make to the OpenAI API."),
+    verbose: bool = typer.Option(True, help="If True, print the prompt of the first example (useful for debugging)."),
 ):
     """Evaluate an OpenAI based large language model for multi-document summarization."""
 
     # Load the dataset
-    dataset = load_dataset(dataset_name, dataset_config_name, split=split)
-    max_examples = max_examples or len(dataset)
-    dataset = dataset.select(range(max_examples))
+    if max_examples:
+        # Stream the dataset so we only fetch the examples we need, rather than materializing the whole split
+        dataset = load_dataset(dataset_name, dataset_config_name, split=split, streaming=True).take(max_examples)
+    else:
+        dataset = load_dataset(dataset_name, dataset_config_name, split=split)
+        max_examples = len(dataset)
     print(
         f'Loaded dataset "{dataset_name}" (config="{dataset_config_name}", split="{split}", max_examples={max_examples})'
     )
@@ -141,65 +172,88 @@ Source documents
 
 Summary:""",
     )
+    # These are constant across examples, so bind them once rather than passing them on every call
+    prompt = prompt.partial(max_words=str(max_words), ic_examples=ic_examples)
 
     # Setup the chain
     chain = LLMChain(llm=llm, prompt=prompt)
 
     # Run the chain
-    inputs, references, outputs = [], [], []
+    inputs, references, prompt_documents, keys = [], [], [], []
     example_printed = False
+    # Pre-render everything but the documents once, so formatting each example's prompt is a simple concatenation
+    prompt_prefix, prompt_suffix = prompt.format(documents="{documents}").split("{documents}")
     # This is the maximum number of tokens remaining in the prompt for the input documents
-    max_documents_len = max_input_tokens - llm.get_num_tokens(
-        prompt.format(max_words=max_words, ic_examples=ic_examples, documents="")
-    )
-    for example in track(dataset, description="Generating summaries"):
+    max_documents_len = max_input_tokens - _get_num_tokens(tokenizer, prompt_prefix + prompt_suffix)
+
+    def _prepare(example: Dict[str, str]) -> Optional[Dict[str, str]]:
+        """Format the inputs, truncate, and sanitize. This is pure CPU work, so it is run in a threadpool."""
         if not example["document"].strip():
-            continue
-        # Format the inputs, truncate, and sanitize
+            return None
         documents, summary = util.sanitize_text(example["document"]), util.sanitize_text(example["summary"])
         if dataset_name == "multi_news" or "multinews" in dataset_name:
             documents, summary = util.preprocess_multi_news(documents, summary, doc_sep_token=DOC_SEP_TOKEN)
         else:
             documents, summary = util.preprocess_wcep(documents, summary, doc_sep_token=DOC_SEP_TOKEN)
-        documents = util.truncate_multi_doc(
+        truncated_docs = util.split_and_truncate_multi_doc(
             documents,
             doc_sep_token=DOC_SEP_TOKEN,
             max_length=max_documents_len,
             tokenizer=tokenizer,
+            # We are already running in a threadpool, so don't spin up another one per example
+            num_threads=1,
         )
-        # Keep track of what we are inputting to the model
-        inputs.append(documents)
-        references.append(summary)
-        documents = "\n".join(
-            f"Source {i+1}: {doc}" for i, doc in enumerate(util.split_docs(documents, doc_sep_token=DOC_SEP_TOKEN))
-        )
-        # Print the first example, helpful for debugging / catching errors in the prompt
-        formatted_prompt = prompt.format(max_words=max_words, ic_examples=ic_examples, documents=documents)
-        example_printed = _print_example_prompt(llm, example_prompt=formatted_prompt, example_printed=example_printed)
-
-        # Get projected cost of the experiement
-        if dry_run:
-            with get_openai_callback() as cb:
-                output = chain.run(max_words=max_words, ic_examples=ic_examples, documents=documents)
-                print("[yellow]--dry-run flag passed. Getting projected cost and exiting.[/yellow]")
-                print(
-                    (
-                        "Projected cost for one example."
-                        f" Actual cost will be ~max_examples={max_examples} this amount (excluding cached examples)."
-                    )
+        documents = "\n".join(f"Source {i+1}: {doc}" for i, doc in enumerate(truncated_docs))
+        return {
+            "input": f" {DOC_SEP_TOKEN} ".join(truncated_docs),
+            "reference": summary,
+            "documents": documents,
+            "prompt": prompt_prefix + documents + prompt_suffix,
+        }
+
+    # Open the cache once, rather than once per example
+    with Cache(util.CACHE_DIR) as cache, ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        # map yields results in order, so we can start consuming them while later examples are still being prepared
+        for prepared in track(executor.map(_prepare, dataset), total=max_examples, description="Preparing inputs"):
+            if prepared is None:
+                continue
+            # Keep track of what we are inputting to the model
+            inputs.append(prepared["input"])
+            references.append(prepared["reference"])
+            documents, formatted_prompt = prepared["documents"], prepared["prompt"]
+            # Print the first example, helpful for debugging / catching errors in the prompt
+            if verbose:
+                example_printed = _print_example_prompt(
+                    tokenizer, example_prompt=formatted_prompt, example_printed=example_printed
                 )
-                print(cb)
-                raise typer.Exit()
-
-        # Run the chain, retrieving the output from the cache if we have already run this example
-        with Cache(util.CACHE_DIR) as reference:
-            key = util.sanitize_text(f"{model_name}_{temperature}_{formatted_prompt}", lowercase=True)
-            if key in reference and use_cache:
-                output = reference[key]
-            else:
-                output = chain.run(max_words=max_words, ic_examples=ic_examples, documents=documents)
-                reference[key] = output
-        outputs.append(output)
+
+            # Get projected cost of the experiement
+            if dry_run:
+                # No need to finish preparing the remaining examples
+                executor.shutdown(wait=False, cancel_futures=True)
+                with get_openai_callback() as cb:
+                    output = chain.run(documents=documents)
+                    print("[yellow]--dry-run flag passed. Getting projected cost and exiting.[/yellow]")
+                    print(
+                        (
+                            "Projected cost for one example."
+                            f" Actual cost will be ~max_examples={max_examples} this amount"
+                            " (excluding cached examples)."
+                        )
+                    )
+                    print(cb)
+                    raise typer.Exit()
+
+            keys.append(util.sanitize_text(f"{model_name}_{temperature}_{formatted_prompt}", lowercase=True))
+            prompt_documents.append(documents)
+
+        # Retrieve outputs from the cache if we have already run an example, and run the chain on the rest
+        cached = {key: cache[key] for key in keys if use_cache and key in cache}
+        # Identical prompts (e.g. from duplicate examples) only need to be sent to the model once
+        uncached = {key: documents for key, documents in zip(keys, prompt_documents) if key not in cached}
+        with Status(f"Generating summaries for {len(uncached)} uncached examples"):
+            cached.update(asyncio.run(_generate(chain, uncached, cache=cache, concurrency=concurrency)))
+        outputs = [cached[key] for key in keys]
 
     # Key prefix for certain outputs, chosen to match the HuggingFace scripts
     metric_key_prefix = "predict" if split == "test" else "eval"
@@ -243,7 +297,9 @@ Summary:""",
         with Status("Computing ROUGE scores"):
             rouge_results = metrics.compute_rouge(predictions=outputs, references=references[: len(outputs)])
         with Status("Computing BERTScore"):
-            bertscore_results = metrics.compute_bertscore(predictions=outputs, references=references[: len(outputs)])
+            bertscore_results = metrics.compute_bertscore(
+                predictions=outputs, references=references[: len(outputs)], mixed_precision=mixed_precision
+            )
         # These need to match the naming in the HuggingFace scripts for evaluation
         rouge_results = {f"{metric_key_prefix}_{k}": v for k, v in rouge_results.items()}
         bertscore_results = {f"{metric_key_prefix}_{k}": v for k, v in bertscore_results.items()}
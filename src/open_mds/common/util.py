@@ -1,8 +1,9 @@
 import json
+import os
 import re
 import sys
 import warnings
-from itertools import zip_longest
+from itertools import accumulate, zip_longest
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Tuple, Union
 
@@ -21,6 +22,7 @@ _PERTURBATIONS_DIR = "perturbations"
 _RETRIEVAL_DIR = "retrieval"
 _TRAINING_DIR = "training"
 _RESULTS_FILENAME = "all_results.json"
+_CHECKPOINT_PATTERN = re.compile(r"checkpoint-(\d+)")
 
 # Public constants
 DOC_SEP_TOKENS = {"primera": "<doc-sep>", "multi_news": "|||||", "ccdv/WCEP-10": "</s>"}
@@ -35,12 +37,11 @@ def sanitize_text(text: str, lowercase: bool = False) -> str:
 
 
 def unflatten(iterable, lengths):
-    unflattened = []
-    for i in range(len(lengths)):
-        start = lengths[i - 1] if i >= 1 else 0
-        end = start + lengths[i]
-        unflattened.append(iterable[start:end])
-    return unflattened
+    """Splits `iterable` into consecutive chunks of the given `lengths`, i.e. the inverse of flattening a list of
+    lists where the ith list has length `lengths[i]`.
+    """
+    offsets = [0, *accumulate(lengths)]
+    return [iterable[start:end] for start, end in zip(offsets, offsets[1:])]
 
 
 def parse_omega_conf() -> Dict[str, Any]:
@@ -67,12 +68,17 @@ def split_docs(text: str, doc_sep_token: str) -> List[str]:
     return docs
 
 
-def get_num_docs(text: str, doc_sep_token: str) -> int:
+def get_num_docs(text: Union[str, List[str]], doc_sep_token: Optional[str] = None) -> int:
     """Given `text`, a string which contains the input documents seperated by `doc_sep_token`,
-    returns the number of individual documents.
+    returns the number of individual documents. `text` may also be a list of documents that have
+    already been split (e.g. by `split_docs`), in which case `doc_sep_token` is not needed.
     """
+    if isinstance(text, str):
+        if doc_sep_token is None:
+            raise ValueError("doc_sep_token must be provided if text is a string.")
+        text = split_docs(text, doc_sep_token=doc_sep_token)
     # See: https://stackoverflow.com/a/3393470
-    return len(list(filter(bool, split_docs(text, doc_sep_token=doc_sep_token))))
+    return len(list(filter(bool, text)))
 
 
 def get_doc_sep_token(tokenizer: PreTrainedTokenizerBase) -> str:
@@ -127,6 +133,25 @@ def truncate_multi_doc(
     is done as if there are `num_docs` number of input documents. This is useful to control
     for truncation when applying pertubations (e.g. additiion and deletion).
     """
+    truncated_docs = split_and_truncate_multi_doc(
+        text, doc_sep_token=doc_sep_token, max_length=max_length, tokenizer=tokenizer, num_docs=num_docs
+    )
+    return f" {doc_sep_token} ".join(truncated_docs)
+
+
+def split_and_truncate_multi_doc(
+    text: str,
+    doc_sep_token: str,
+    max_length: int,
+    tokenizer: Union[PreTrainedTokenizerBase, tiktoken.core.Encoding],
+    num_docs: Optional[int] = None,
+    num_threads: Optional[int] = None,
+) -> List[str]:
+    """Identical to `truncate_multi_doc`, but returns the list of truncated documents rather than joining them with
+    `doc_sep_token`. Useful when the caller needs the individual documents, as it saves re-splitting the output.
+    If `tokenizer` is a tiktoken encoding, documents are encoded in parallel using `num_threads` threads (defaults
+    to the number of CPUs). Callers that are already multi-threaded should pass `num_threads=1`.
+    """
     input_docs = split_docs(text, doc_sep_token=doc_sep_token)
 
     # Setup encode/decode functions based on the type of tokenizer
@@ -143,16 +168,20 @@ def truncate_multi_doc(
             f"tokenizer must be either a PreTrainedTokenizerBase or a tiktoken.core.Encoding, got {type(tokenizer)}"
         )
     if len(encode(text)) > max_length:
-        # If num_docs is not provided, determine it from the input text
-        num_docs = num_docs or get_num_docs(text, doc_sep_token=doc_sep_token)
+        num_docs = num_docs or get_num_docs(input_docs)
         # make room for doc_sep_token's
         max_doc_length = max_length - len(encode(f" {doc_sep_token} ")) * (num_docs - 1)
         max_doc_length = max_doc_length // num_docs
+        # tiktoken can encode a batch of documents in parallel, which is much faster than one at a time.
+        if isinstance(tokenizer, tiktoken.core.Encoding):
+            encoded_docs = tokenizer.encode_batch(input_docs, num_threads=num_threads or os.cpu_count() or 1)
+        else:
+            encoded_docs = [encode(doc) for doc in input_docs]
         # Going to join everything on a space at the end, so strip it off here.
-        truncated_docs = [decode(encode(doc)[:max_doc_length]).strip() for doc in input_docs]
+        truncated_docs = [decode(tokens[:max_doc_length]).strip() for tokens in encoded_docs]
     else:
         truncated_docs = input_docs
-    return f" {doc_sep_token} ".join(truncated_docs)
+    return truncated_docs
 
 
 def batch_decode_multi_doc(sequences, tokenizer: PreTrainedTokenizerBase, doc_sep_token: str, **kwargs):
@@ -169,7 +198,9 @@ def batch_decode_multi_doc(sequences, tokenizer: PreTrainedTokenizerBase, doc_se
         pattern += rf"|{tokenizer.bos_token}"
     if tokenizer.eos_token is not None and tokenizer.eos_token != doc_sep_token:
         pattern += rf"|{tokenizer.eos_token}"
-    decoded_sequences = [re.sub(pattern, "", inputs).strip() for inputs in decoded_sequences]
+    # Compile once, as the same pattern is applied to every sequence
+    special_tokens = re.compile(pattern)
+    decoded_sequences = [special_tokens.sub("", inputs).strip() for inputs in decoded_sequences]
     return decoded_sequences
 
 
@@ -365,7 +396,7 @@ def load_results_dicts(
             results_df = _read_result_dict(results_dict)
 
             # This is a little brittle, but if the filepath is named after a checkpoint, save it in the results_df
-            checkpoint = re.search(r"checkpoint-(\d+)", str(filepath.parent.name))
+            checkpoint = _CHECKPOINT_PATTERN.search(str(filepath.parent.name))
             results_df["checkpoint"] = int(checkpoint.group(1)) if checkpoint is not None else None
 
             if baseline_df is not None:
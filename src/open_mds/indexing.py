@@ -1,4 +1,5 @@
 import shutil
+from functools import lru_cache
 from pathlib import Path
 from typing import Any, Dict, Iterator, List, Optional
 
@@ -50,6 +51,22 @@ def _sanitize_query(topics: pd.DataFrame) -> pd.DataFrame:
     return pt.apply.query(lambda x: _strip_markup(x.query))(topics)
 
 
+@lru_cache(maxsize=4)
+def load_index(index_path: str) -> Any:
+    """Loads the PyTerrier index at `index_path`. This is only an in-process cache: repeated calls within the same
+    Python process (e.g. from a notebook) reuse the loaded index, but each new process loads it again.
+    """
+    return pt.IndexFactory.of(index_path)
+
+
+def group_retrieved_by_qid(retrieved: pd.DataFrame) -> Dict[str, List[str]]:
+    """Returns a dictionary mapping each qid in `retrieved` to the docnos retrieved for it (in rank order). Building
+    this once lets the retrieved documents of each query be looked up in constant time, rather than filtering all of
+    `retrieved` for every query.
+    """
+    return retrieved.groupby("qid", sort=False)["docno"].agg(list).to_dict()
+
+
 class HuggingFacePyTerrierDataset(pt.datasets.Dataset):
     """Simple wrapper for the PyTerrier Dataset class to make it easier to interface with HuggingFace Datasets."""
 
@@ -59,15 +76,44 @@ class HuggingFacePyTerrierDataset(pt.datasets.Dataset):
         self._hf_dataset = load_dataset(self.path, self.name, **kwargs)
 
     def replace(
-        self, example: Dict[str, Any], idx: int, *, split: str, retrieved: pd.DataFrame, k: Optional[int] = None
+        self,
+        example: Dict[str, Any],
+        idx: int,
+        *,
+        split: str,
+        retrieved: Dict[str, List[str]],
+        k: Optional[int] = None
     ) -> Dict[str, Any]:
         """This method replaces the original source documents of an `example` from a HuggingFace dataset with the
-        top-`k` documents in `retrieved`. It is expected that this function will be passed to the `map` method of
+        top-`k` documents in `retrieved`, a dictionary mapping qids to ranked lists of docnos (see
+        `group_retrieved_by_qid`). It is expected that this function will be passed to the `map` method of
         the HuggingFace Datasets library with the argument `with_indices=True`. If `k` is `None`, it will be set
         dynamically for each example as the original number of source documents. Must be implemented by child class.
         """
         raise NotImplementedError("Method 'replace' must be implemented by the child class.")
 
+    def replace_batched(
+        self,
+        examples: Dict[str, List[Any]],
+        indices: List[int],
+        *,
+        split: str,
+        retrieved: Dict[str, List[str]],
+        k: Optional[int] = None,
+    ) -> Dict[str, List[Any]]:
+        """A batched version of `replace`. It is expected that this function will be passed to the `map` method of
+        the HuggingFace Datasets library with the arguments `batched=True` and `with_indices=True`, which avoids the
+        overhead of calling into Python once per example.
+        """
+        replaced: Dict[str, List[Any]] = {key: [] for key in examples}
+        for i, idx in enumerate(indices):
+            example = self.replace(
+                {key: values[i] for key, values in examples.items()}, idx, split=split, retrieved=retrieved, k=k
+            )
+            for key in replaced:
+                replaced[key].append(example[key])
+        return replaced
+
     def get_corpus_iter(self, verbose: bool = True) -> Iterator[Dict[str, Any]]:
         """Returns an iterator that yields dictionaries with the keys "docno" and "text" for each example in the
         dataset. Must be implemented by child class.
@@ -121,7 +167,13 @@ class CanonicalMDSDataset(HuggingFacePyTerrierDataset):
         self._doc_sep_token = doc_sep_token
 
     def replace(
-        self, example: Dict[str, Any], idx: int, *, split: str, retrieved: pd.DataFrame, k: Optional[int] = None
+        self,
+        example: Dict[str, Any],
+        idx: int,
+        *,
+        split: str,
+        retrieved: Dict[str, List[str]],
+        k: Optional[int] = None
     ) -> Dict[str, Any]:
 
         # The decision to skip examples with no input documents is also made in the HF run_summarization.py script.
@@ -136,10 +188,12 @@ class CanonicalMDSDataset(HuggingFacePyTerrierDataset):
         # It would be less complicated to retrieve the text from the PyTerrier MetaIndex, but these documents are
         # not identical due to some string processing.
         retrieved_docs = []
-        retrieved_docnos = retrieved[retrieved.qid == qid][:k]["docno"].tolist()
+        retrieved_docnos = retrieved.get(qid, [])[:k]
         for docno in retrieved_docnos:
             retrieved_split, example_idx, document_idx = docno.split("_")
-            retrieved_example = self._hf_dataset[retrieved_split]["document"][int(example_idx)]
+            # Index the row first. Indexing the column first would materialize the entire "document" column of the
+            # split as a Python list, once per retrieved document
+            retrieved_example = self._hf_dataset[retrieved_split][int(example_idx)]["document"]
             retrieved_doc = util.split_docs(retrieved_example, doc_sep_token=self._doc_sep_token)[int(document_idx)]
             retrieved_docs.append(retrieved_doc)
         example["document"] = f" {self._doc_sep_token} ".join(doc.strip() for doc in retrieved_docs)
@@ -226,14 +280,20 @@ class MultiXScienceDataset(HuggingFacePyTerrierDataset):
                     self._documents[docno] = text
 
     def replace(
-        self, example: Dict[str, Any], idx: int, *, split: str, retrieved: pd.DataFrame, k: Optional[int] = None
+        self,
+        example: Dict[str, Any],
+        idx: int,
+        *,
+        split: str,
+        retrieved: Dict[str, List[str]],
+        k: Optional[int] = None
     ) -> Dict[str, Any]:
         qid = f"{split}_{idx}"
         k = k or len(example["ref_abstract"]["abstract"])
         # We would like to get the original, unaltered text from the dataset, so we use the docno's to key in.
         # It would be less complicated to retrieve the text from the PyTerrier MetaIndex, but these documents are
         # not identical due to some string processing.
-        retrieved_docnos = retrieved[retrieved.qid == qid][:k]["docno"].tolist()
+        retrieved_docnos = retrieved.get(qid, [])[:k]
         example["ref_abstract"]["mid"] = retrieved_docnos
         example["ref_abstract"]["abstract"] = [self._documents[docno] for docno in retrieved_docnos]
         return example
@@ -317,14 +377,20 @@ class MSLR2022Dataset(HuggingFacePyTerrierDataset):
                     self._documents[docno] = {"title": title, "abstract": abstract}
 
     def replace(
-        self, example: Dict[str, Any], idx: int, *, split: str, retrieved: pd.DataFrame, k: Optional[int] = None
+        self,
+        example: Dict[str, Any],
+        idx: int,
+        *,
+        split: str,
+        retrieved: Dict[str, List[str]],
+        k: Optional[int] = None
     ) -> Dict[str, Any]:
         qid = example["review_id"]
         k = k or len(example["pmid"])
         # We would like to get the original, unaltered text from the dataset, so we use the docno's to key in.
         # It would be less complicated to retrieve the text from the PyTerrier MetaIndex, but these documents are
         # not identical due to some string processing.
-        retrieved_docnos = retrieved[retrieved.qid == qid][:k]["docno"].tolist()
+        retrieved_docnos = retrieved.get(qid, [])[:k]
         example["pmid"] = [docno for docno in retrieved_docnos]
         example["title"] = [self._documents[docno]["title"] for docno in retrieved_docnos]
         example["abstract"] = [self._documents[docno]["abstract"] for docno in retrieved_docnos]
@@ -1,8 +1,11 @@
+import hashlib
 import math
 import random
 import warnings
+from collections import defaultdict, deque
 from itertools import zip_longest
-from typing import Dict, List, Optional, Tuple
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Tuple
 
 import more_itertools
 import nlpaug.augmenter.word as naw
@@ -17,6 +20,56 @@ from open_mds.common import util
 _SEMANTIC_SIMILARITY_MODEL = "all-MiniLM-L6-v2"
 _BT_FROM_MODEL_NAME = "Helsinki-NLP/opus-mt-en-da"
 _BT_TO_MODEL_NAME = "Helsinki-NLP/opus-mt-da-en"
+_BT_BATCH_SIZE = 64
+# Maximum number of sentences to backtranslate before writing results to the cache
+_BT_CHUNK_SIZE = 1024
+# Embeddings get their own on-disk cache, so they can't evict the (much more expensive) LLM outputs and
+# backtranslations stored in `util.CACHE_DIR` when the cache hits its size limit
+_EMBEDDINGS_CACHE_DIR = str(Path(util.CACHE_DIR) / "embeddings")
+# In-memory index of document embeddings shared by all Perturber instances. Keys include the embedding model name and
+# precision (see `Perturber._get_embedding_key`), so entries are only ever reused for the same model and precision
+_DOC_EMBEDDINGS: Dict[str, torch.Tensor] = {}
+# Minimum number of documents to embed before encoding is distributed across GPUs (if more than one is available)
+_MULTI_PROCESS_MIN_DOCS = 10_000
+
+
+def _chunk_by_size(sizes: List[int], max_size: int) -> List[Tuple[int, int]]:
+    """Returns a list of `(start, end)` indices that split items with the given `sizes` into consecutive chunks whose
+    total size is at most `max_size`. An item larger than `max_size` gets a chunk of its own.
+    """
+    chunks, start, total = [], 0, 0
+    for i, size in enumerate(sizes):
+        if i > start and total + size > max_size:
+            chunks.append((start, i))
+            start, total = i, 0
+        total += size
+    if start < len(sizes):
+        chunks.append((start, len(sizes)))
+    return chunks
+
+
+def _replace_docs(documents: List[str], to_replace: List[str], replacements: List[str]) -> List[str]:
+    """Returns a copy of `documents` where each document in `to_replace` is swapped for the corresponding document in
+    `replacements`. If a document occurs more than once, its occurrences are replaced in order, one per occurrence in
+    `to_replace` (i.e. the same result as repeatedly replacing `documents[documents.index(doc)]`).
+    """
+    positions: Dict[str, Deque[int]] = defaultdict(deque)
+    for i, doc in enumerate(documents):
+        positions[doc].append(i)
+    replaced = list(documents)
+    for doc, replacement in zip(to_replace, replacements):
+        replaced[positions[doc].popleft()] = replacement
+    return replaced
+
+
+def _get_doc_indices(documents: List[str]) -> Dict[str, int]:
+    """Returns a dictionary mapping each document in `documents` to the index of its first occurrence. Equivalent to
+    calling `documents.index(doc)` for each document, but without a linear scan per lookup.
+    """
+    doc_indices: Dict[str, int] = {}
+    for i, doc in enumerate(documents):
+        doc_indices.setdefault(doc, i)
+    return doc_indices
 
 
 class Perturber:
@@ -53,8 +106,12 @@ class Perturber:
 
         self._perturbation_func = perturbation_func
         self._doc_sep_token = doc_sep_token
+        # Documents are joined with this separator after perturbation, so only build it once
+        self._doc_sep = f" {doc_sep_token} "
         self._strategy = strategy
         self._seed = seed
+        # Note that we stick with the random module (rather than e.g. numpy's Generator) so that seeded perturbations
+        # are reproducible across versions. We only sample a handful of documents at a time, so speed is not an issue
         self._rng = random.Random(self._seed)
 
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
@@ -63,8 +120,22 @@ class Perturber:
         self._embedder = None
         if self._strategy != "random":
             self._embedder = st.SentenceTransformer(_SEMANTIC_SIMILARITY_MODEL, device=self.device)
-        # We also maintain an "index" of document embeddings to reduce duplicate computation
-        self._index: Dict[int, torch.Tensor] = {}
+            # On GPU, embed and score in half precision. This halves memory traffic, with a negligible effect on
+            # which documents get selected
+            if self.device == "cuda":
+                self._embedder.half()
+            # We only ever use the embedder for inference
+            self._embedder.eval()
+        self._embedding_dtype = torch.float16 if self.device == "cuda" else torch.float32
+        # We also maintain an "index" of document embeddings, keyed by a hash of each document's content, to reduce
+        # duplicate computation. This is shared by all instances (see `_DOC_EMBEDDINGS`) and backed by an on-disk
+        # cache so embeddings persist between runs
+        self._index = _DOC_EMBEDDINGS
+        # Pool of processes for encoding on multiple GPUs. Started lazily (see `_encode`)
+        self._pool: Optional[Dict[str, Any]] = None
+        # The candidate documents of the current call, and their embeddings (see `__call__`)
+        self._documents: Optional[List[str]] = None
+        self._doc_embeddings: Optional[torch.Tensor] = None
 
         # Some perturbations require special components, like a backtranslation model
         self._aug = None
@@ -75,7 +146,18 @@ class Perturber:
                 device=self.device,
                 # We backtranslate on individual sentences, so this max_length should be plenty.
                 max_length=256,
+                # Sentences are short, so we can afford larger batches than the default (32)
+                batch_size=_BT_BATCH_SIZE,
             )
+            # Backtranslation dominates runtime for this perturbation. On GPU, run the MT models in half precision,
+            # which roughly halves their memory footprint and speeds up generation.
+            if self.device == "cuda":
+                self._aug.model.src_model.half()
+                self._aug.model.tgt_model.half()
+
+    def __del__(self) -> None:
+        if getattr(self, "_pool", None) is not None:
+            st.SentenceTransformer.stop_multi_process_pool(self._pool)
 
     def __repr__(self) -> str:
         return (
@@ -134,10 +216,16 @@ class Perturber:
         # Need an iterable, but an empty list as default value is bad practice
         targets = targets or []
 
-        # All examples that can be considered for selection (ignoring duplicates)
-        documents = inputs + documents if documents is not None else inputs
+        # All examples that can be considered for selection (ignoring duplicates). We deduplicate individual documents,
+        # not just examples, so that each unique document is only embedded once. A dict (rather than a set) keeps the
+        # order deterministic, which matters for reproducible sampling under the random strategy. Extra `documents` are
+        # only candidates for addition and replacement, so don't bother including (and embedding) them otherwise
+        if documents is not None and self._perturbation in ["addition", "replacement"]:
+            documents = inputs + documents
+        else:
+            documents = inputs
         documents = list(
-            set(
+            dict.fromkeys(
                 more_itertools.flatten(
                     util.split_docs(example, doc_sep_token=self._doc_sep_token) for example in documents
                 )
@@ -150,14 +238,28 @@ class Perturber:
                 inputs=inputs, unperturbed_indices=unperturbed_indices, documents=documents
             )
 
-        perturbed_inputs = []
-        for example, target in tqdm(
-            zip_longest(inputs, targets), desc="Perturbing inputs", total=max(len(inputs), len(targets))
-        ):
-            perturbed_example = self._perturbation_func(  # type: ignore
-                example=example, target=target, perturbed_frac=perturbed_frac, documents=documents
-            )
-            perturbed_inputs.append(perturbed_example)
+        # For non-random strategies, embed all documents and targets up front in a single batched call. Selection
+        # within the (per-example) loop below then only has to look up embeddings from the index. The embeddings of
+        # `documents` are constant across examples, so we also hold on to them to avoid re-collecting them each time
+        if self._strategy != "random":
+            embeddings = self._get_doc_embeddings(documents + targets)  # type: ignore
+            self._documents, self._doc_embeddings = documents, embeddings[: len(documents)]  # type: ignore
+
+        # Note that this loop is deliberately serial. Under the random strategy, all examples draw from the same seeded
+        # RNG, so the output depends on the order examples are processed in. Farming examples out to a process pool
+        # would break reproducibility, and the per-example work is cheap relative to pickling `documents` to workers
+        # (perturbed_frac is always set for backtranslation by this point, see the early return above)
+        if self._perturbation == "backtranslation" and perturbed_frac is not None:
+            perturbed_inputs = self._backtranslation_batch(inputs, targets=targets, perturbed_frac=perturbed_frac)
+        else:
+            perturbed_inputs = []
+            for example, target in tqdm(
+                zip_longest(inputs, targets), desc="Perturbing inputs", total=max(len(inputs), len(targets))
+            ):
+                perturbed_example = self._perturbation_func(  # type: ignore
+                    example=example, target=target, perturbed_frac=perturbed_frac, documents=documents
+                )
+                perturbed_inputs.append(perturbed_example)
 
         # ... then, insert them back in their original positions after perturbation
         if unperturbed_indices is not None:
@@ -167,6 +269,8 @@ class Perturber:
                 unperturbed_indices=unperturbed_indices,
             )
 
+        self._documents, self._doc_embeddings = None, None
+
         return perturbed_inputs
 
     def backtranslation(
@@ -180,27 +284,52 @@ class Perturber:
         """ """
 
         input_docs = util.split_docs(example, doc_sep_token=self._doc_sep_token)
-        num_docs = util.get_num_docs(example, doc_sep_token=self._doc_sep_token)
+        sampled_docs = self._select_backtranslation_docs(input_docs, perturbed_frac=perturbed_frac, target=target)
+
+        # Back translate the sampled documents. To save computation, cache the backtranslation results to disk
+        back_translated_docs = self._get_backtranslated_docs(sampled_docs)
+
+        perturbed_example = self._doc_sep.join(_replace_docs(input_docs, sampled_docs, back_translated_docs))
+        return perturbed_example
+
+    def _backtranslation_batch(self, inputs: List[str], *, targets: List[str], perturbed_frac: float) -> List[str]:
+        """Equivalent to calling `backtranslation` on each of `inputs` (and `targets`), but documents are selected for
+        every example first and then backtranslated together, so the MT models see a few large batches rather than
+        many small ones. Examples are processed in order, so the output is identical for a given seed.
+        """
+        input_docs, sampled_docs = [], []
+        for example, target in tqdm(
+            zip_longest(inputs, targets), desc="Selecting documents", total=max(len(inputs), len(targets))
+        ):
+            docs = util.split_docs(example, doc_sep_token=self._doc_sep_token)
+            input_docs.append(docs)
+            sampled_docs.append(self._select_backtranslation_docs(docs, perturbed_frac=perturbed_frac, target=target))
+
+        back_translated_docs = self._get_backtranslated_docs(list(more_itertools.flatten(sampled_docs)))
+        translated_per_example: List[List[str]] = util.unflatten(
+            back_translated_docs, [len(sampled) for sampled in sampled_docs]
+        )
+
+        perturbed_inputs = []
+        for docs, sampled, translated in zip(input_docs, sampled_docs, translated_per_example):
+            perturbed_inputs.append(self._doc_sep.join(_replace_docs(docs, sampled, translated)))
+        return perturbed_inputs
+
+    def _select_backtranslation_docs(
+        self, input_docs: List[str], *, perturbed_frac: float, target: Optional[str] = None
+    ) -> List[str]:
+        """Returns the documents in `input_docs` to backtranslate, according to the selected `strategy`."""
+        num_docs = util.get_num_docs(input_docs)
 
         # The absolute number of documents to perturb
         k = math.ceil(perturbed_frac * num_docs)
 
         # If we are backtranslating all documents, we do not need to sample
         if k == num_docs:
-            sampled_docs = input_docs
-        elif self._strategy == "random":
-            sampled_docs = self._select_docs(input_docs, k=k)
-        else:
-            sampled_docs = self._select_docs(documents=input_docs, k=k, target=target, largest=False)
-
-        # Back translate the sampled documents. To save computation, cache the backtranslation results to disk
-        back_translated_docs = self._get_backtranslated_docs(sampled_docs)
-
-        for sampled, translated in zip(sampled_docs, back_translated_docs):
-            input_docs[input_docs.index(sampled)] = translated
-
-        perturbed_example = f" {self._doc_sep_token} ".join(input_docs)
-        return perturbed_example
+            return input_docs
+        if self._strategy == "random":
+            return self._select_docs(input_docs, k=k)
+        return self._select_docs(documents=input_docs, k=k, target=target, largest=False)
 
     def sorting(
         self,
@@ -235,7 +364,7 @@ class Perturber:
                 target=target,
             )
 
-        perturbed_example = f" {self._doc_sep_token} ".join(input_docs)
+        perturbed_example = self._doc_sep.join(input_docs)
         return perturbed_example
 
     def duplication(
@@ -262,7 +391,7 @@ class Perturber:
             Has no effect. Exists for consistency with other perturbation functions.
         """
         input_docs = util.split_docs(example, doc_sep_token=self._doc_sep_token)
-        num_docs = util.get_num_docs(example, doc_sep_token=self._doc_sep_token)
+        num_docs = util.get_num_docs(input_docs)
 
         # The absolute number of documents to perturb
         k = math.ceil(perturbed_frac * num_docs)
@@ -279,7 +408,7 @@ class Perturber:
                 target=target,
             )
 
-        perturbed_example = f" {self._doc_sep_token} ".join(input_docs + repeaters)
+        perturbed_example = self._doc_sep.join(input_docs + repeaters)
         return perturbed_example
 
     def addition(
@@ -307,7 +436,7 @@ class Perturber:
             If provided, documents will be perturbed based on comparison to this text.
         """
         input_docs = util.split_docs(example, doc_sep_token=self._doc_sep_token)
-        num_docs = util.get_num_docs(example, doc_sep_token=self._doc_sep_token)
+        num_docs = util.get_num_docs(input_docs)
 
         # The absolute number of documents to perturb
         k = math.ceil(perturbed_frac * num_docs)
@@ -322,7 +451,7 @@ class Perturber:
                 target=target,
             )
 
-        perturbed_example = f" {self._doc_sep_token} ".join(input_docs + sampled_docs)
+        perturbed_example = self._doc_sep.join(input_docs + sampled_docs)
         return perturbed_example
 
     def deletion(
@@ -349,7 +478,7 @@ class Perturber:
             Has no effect. Exists for consistency with other perturbation functions.
         """
         input_docs = util.split_docs(example, doc_sep_token=self._doc_sep_token)
-        num_docs = util.get_num_docs(example, doc_sep_token=self._doc_sep_token)
+        num_docs = util.get_num_docs(input_docs)
 
         # The absolute number of documents to perturb
         k = math.ceil(perturbed_frac * num_docs)
@@ -358,8 +487,9 @@ class Perturber:
         if k == num_docs:
             return ""
 
+        # Collect the indices to delete in a set, so each membership check below is constant time
         if self._strategy == "random":
-            to_delete = self._rng.sample(range(num_docs), k)
+            to_delete = set(self._rng.sample(range(num_docs), k))
         else:
             sampled_docs = self._select_docs(
                 documents=input_docs,
@@ -367,12 +497,11 @@ class Perturber:
                 target=target,
                 largest=False,
             )
-            to_delete = [input_docs.index(doc) for doc in sampled_docs]
+            doc_indices = _get_doc_indices(input_docs)
+            to_delete = {doc_indices[doc] for doc in sampled_docs}
 
         # Collect the perturbed example
-        pertured_example = f" {self._doc_sep_token} ".join(
-            doc for j, doc in enumerate(input_docs) if j not in to_delete
-        )
+        pertured_example = self._doc_sep.join(doc for j, doc in enumerate(input_docs) if j not in to_delete)
         return pertured_example
 
     def replacement(
@@ -400,7 +529,7 @@ class Perturber:
             If provided, documents will be perturbed based on comparison to this text.
         """
         input_docs = util.split_docs(example, doc_sep_token=self._doc_sep_token)
-        num_docs = util.get_num_docs(example, doc_sep_token=self._doc_sep_token)
+        num_docs = util.get_num_docs(input_docs)
 
         # The absolute number of documents to perturb
         k = math.ceil(perturbed_frac * num_docs)
@@ -426,14 +555,16 @@ class Perturber:
                 target=target,
                 largest=False,
             )
-        replace_indices = [input_docs.index(doc) for doc in to_replace]
+        doc_indices = _get_doc_indices(input_docs)
+        replace_indices = [doc_indices[doc] for doc in to_replace]
 
         for i, doc in zip(replace_indices, sampled_docs):
             input_docs[i] = doc.strip()
 
-        perturbed_example = f" {self._doc_sep_token} ".join(input_docs)
+        perturbed_example = self._doc_sep.join(input_docs)
         return perturbed_example
 
+    @torch.inference_mode()
     def _select_docs(
         self,
         documents: List[str],
@@ -472,13 +603,18 @@ class Perturber:
         # Get the document embeddings, which are needed for non-random strategies
         doc_embeddings = None
         if self._strategy != "random":
-            doc_embeddings = self._get_doc_embeddings(documents)
+            if documents is self._documents:
+                doc_embeddings = self._doc_embeddings
+            else:
+                doc_embeddings = self._get_doc_embeddings(documents)
 
         # If query is provided, remove it from the possible inputs
         if query is not None:
             query_docs = util.split_docs(query, doc_sep_token=self._doc_sep_token)
+            # Build the set once, rather than once per candidate document
+            query_docs_set = set(query_docs)
             indices, documents = zip(  # type: ignore
-                *[(i, doc) for i, doc in enumerate(documents) if doc not in set(query_docs)]
+                *[(i, doc) for i, doc in enumerate(documents) if doc not in query_docs_set]
             )
             if doc_embeddings is not None:
                 doc_embeddings = torch.index_select(
@@ -497,19 +633,21 @@ class Perturber:
 
         # If target is provided, look for docs most similar to it. Otherwise look for docs most similar to the query.
         if target:
-            target_embedding = self._embedder.encode(  # type: ignore
-                target, convert_to_tensor=True, device=self.device, normalize_embeddings=True
-            )
+            target_embedding = self._get_doc_embeddings([target])
             scores = st.util.dot_score(target_embedding, doc_embeddings)[0]
         else:
-            query_embeddings = self._embedder.encode(  # type: ignore
-                query_docs, convert_to_tensor=True, device=self.device, normalize_embeddings=True
-            )
-            scores = st.util.dot_score(query_embeddings, doc_embeddings)
-            scores = torch.mean(scores, axis=0)
-
-        # Return the top k most similar (or dissimilar) documents
-        indices = torch.topk(scores, k=k, largest=largest, sorted=True).indices
+            # The query documents are typically among the documents embedded up front in `__call__`, so look them up
+            # in the index rather than re-encoding them for every example
+            query_embeddings = self._get_doc_embeddings(query_docs)
+            # The mean score over query documents is equal to the score against their mean embedding (dot products are
+            # linear), which saves us from materializing the full |query docs| x |docs| score matrix
+            scores = st.util.dot_score(torch.mean(query_embeddings, dim=0), doc_embeddings)[0]
+
+        # Return the top k most similar (or dissimilar) documents. Note that we score with torch directly rather than
+        # building a vector index (e.g. FAISS). That would be an extra dependency, vector indices don't support
+        # bottom-k queries (largest=False), and scoring is a single matrix-vector product over embeddings on device.
+        # Scores are upcast before ranking, as half precision scores are more prone to (spurious) ties.
+        indices = torch.topk(scores.float(), k=k, largest=largest, sorted=True).indices
         return [documents[i] for i in indices]
 
     def _remove_unperturbed(
@@ -523,10 +661,11 @@ class Perturber:
         example_docs = [
             [doc for i, doc in enumerate(example) if i not in unperturbed_indices] for example in example_docs
         ]
-        inputs = [f" {self._doc_sep_token} ".join(docs) for docs in example_docs]
+        inputs = [self._doc_sep.join(docs) for docs in example_docs]
         # Remove all the unperturbed_docs from documents
         if documents is not None:
-            documents = list(set(documents) - set(more_itertools.flatten(unperturbed_docs)))
+            to_remove = set(more_itertools.flatten(unperturbed_docs))
+            documents = [doc for doc in documents if doc not in to_remove]
         return inputs, unperturbed_docs, documents
 
     def _replace_unperturbed(
@@ -541,47 +680,110 @@ class Perturber:
         for i, (unperturbed_example, perturbed_example) in enumerate(zip(unperturbed_docs, perturbed_docs)):
             for unperturbed_doc, unperturbed_idx in zip(unperturbed_example, unperturbed_indices):
                 perturbed_example.insert(unperturbed_idx, unperturbed_doc)
-            perturbed_inputs[i] = f" {self._doc_sep_token} ".join(perturbed_example)
+            perturbed_inputs[i] = self._doc_sep.join(perturbed_example)
         return perturbed_inputs
 
+    @torch.inference_mode()
     def _get_doc_embeddings(self, documents: List[str]) -> torch.Tensor:
-        """Returns the embeddings for the given `documents`. For certain perturbations, these embeddings will be
-        cached for future use at `self._index`.
+        """Returns the embeddings for the given `documents`. Each unique document is only embedded once, after which
+        its embedding is cached in memory at `self._index` and on disk at `_EMBEDDINGS_CACHE_DIR` for future use.
         """
+        keys = [self._get_embedding_key(doc) for doc in documents]
+        missing = {key: doc for key, doc in zip(keys, documents) if key not in self._index}
+
+        if missing:
+            with Cache(_EMBEDDINGS_CACHE_DIR) as reference:
+                # Load whatever we can from the disk cache, and only embed documents we have never seen before
+                for key in list(missing):
+                    if key in reference:
+                        self._index[key] = reference[key].to(self.device, dtype=self._embedding_dtype)
+                        del missing[key]
+                if missing:
+                    embeddings = self._encode(list(missing.values()))
+                    # Write all new embeddings in a single transaction, rather than one per embedding
+                    with reference.transact():
+                        for key, embedding in zip(missing, embeddings):
+                            self._index[key] = embedding
+                            # Clone, as on CPU `embedding` is a view into the whole batch, and pickling a view
+                            # writes out all of its underlying storage
+                            reference[key] = embedding.cpu().clone()
+
+        if not keys:
+            return torch.empty(0, device=self.device, dtype=self._embedding_dtype)
+        return torch.stack([self._index[key] for key in keys])
+
+    def _encode(self, documents: List[str]) -> torch.Tensor:
+        """Returns the (normalized) embeddings of `documents`. If multiple GPUs are available and there are many
+        documents to embed, encoding is distributed across all of them with a multi-process pool.
+        """
+        if torch.cuda.device_count() > 1 and len(documents) >= _MULTI_PROCESS_MIN_DOCS:
+            # Starting the pool is expensive, so only do it once we know we need it
+            if self._pool is None:
+                self._pool = self._embedder.start_multi_process_pool()  # type: ignore
+            embeddings = self._embedder.encode_multi_process(documents, self._pool)  # type: ignore
+            embeddings = torch.from_numpy(embeddings).to(self.device, dtype=self._embedding_dtype)
+            # encode_multi_process does not support normalize_embeddings, so normalize ourselves
+            return torch.nn.functional.normalize(embeddings, p=2, dim=1)
+        return self._embedder.encode(  # type: ignore
+            documents, convert_to_tensor=True, device=self.device, normalize_embeddings=True
+        )
 
-        if self._perturbation in ["addition", "replacement"]:
-            doc_hash = hash(tuple(documents))
-            if doc_hash in self._index:
-                doc_embeddings = self._index.get(doc_hash)
-            else:
-                doc_embeddings = self._embedder.encode(  # type: ignore
-                    documents, convert_to_tensor=True, device=self.device, normalize_embeddings=True
-                )
-                self._index[doc_hash] = doc_embeddings
-        else:
-            doc_embeddings = self._embedder.encode(  # type: ignore
-                documents, convert_to_tensor=True, device=self.device, normalize_embeddings=True
-            )
-
-        return doc_embeddings
+    def _get_embedding_key(self, document: str) -> str:
+        """Returns the key used to cache the embedding of `document`, which is a hash of the embedding model name, the
+        precision embeddings are computed in and the document's content. Including the precision means that, e.g., a
+        CPU run never picks up half precision embeddings cached by a GPU run. Hashing keeps keys short, regardless of
+        document length.
+        """
+        return hashlib.sha256(f"{_SEMANTIC_SIMILARITY_MODEL}_{self._embedding_dtype}_{document}".encode()).hexdigest()
 
     def _get_backtranslated_docs(self, documents: List[str]) -> List[str]:
         """Returns back-translated copies of the given `documents`. These are expensive to compute, so we cache
         them on disk for future use at `util.CACHE_DIR`.
         """
-        back_translated_docs = []
-
-        for doc in documents:
-            key = f"{_BT_FROM_MODEL_NAME}_{_BT_TO_MODEL_NAME}_{util.sanitize_text(doc, lowercase=True)}"
-            with Cache(util.CACHE_DIR) as reference:
-                if key in reference:
-                    back_translated_docs.append(reference[key])
-                else:
-                    # We backtranslate individual sentences, which improves backtranslation quality.
-                    # This is likely because it more closely matches the MT models training data.
-                    back_translated_sents = self._aug.augment(nltk.sent_tokenize(doc))  # type: ignore
-                    back_translated_doc = util.sanitize_text(" ".join(sent for sent in back_translated_sents))
-                    back_translated_docs.append(back_translated_doc)
-                    reference[key] = back_translated_doc
-
-        return back_translated_docs
+        keys = [self._get_backtranslation_key(doc) for doc in documents]
+
+        # Documents may be repeated (e.g. across examples), but each only needs to be backtranslated once
+        docs_by_key = dict(zip(keys, documents))
+
+        with Cache(util.CACHE_DIR) as reference:
+            back_translated_docs = {key: reference.get(key) for key in docs_by_key}
+            uncached = [key for key, translated in back_translated_docs.items() if translated is None]
+
+            # We backtranslate individual sentences, which improves backtranslation quality.
+            # This is likely because it more closely matches the MT models training data.
+            uncached_docs = [docs_by_key[key] for key in uncached]
+            uncached_sents = [nltk.sent_tokenize(doc) for doc in uncached_docs]
+            # Backtranslate documents in chunks of (roughly) _BT_CHUNK_SIZE sentences, caching each chunk as soon as
+            # it is done. This bounds memory usage, and means an interrupted run doesn't lose its progress
+            for start, end in _chunk_by_size([len(sents) for sents in uncached_sents], max_size=_BT_CHUNK_SIZE):
+                chunk_sents = uncached_sents[start:end]
+                back_translated_sents = self._backtranslate_sents(list(more_itertools.flatten(chunk_sents)))
+                translated_per_doc: List[List[str]] = util.unflatten(
+                    back_translated_sents, [len(sents) for sents in chunk_sents]
+                )
+                with reference.transact():
+                    for key, sents in zip(uncached[start:end], translated_per_doc):
+                        back_translated_doc = util.sanitize_text(" ".join(sent for sent in sents))
+                        back_translated_docs[key] = back_translated_doc
+                        reference[key] = back_translated_doc
+
+        return [back_translated_docs[key] for key in keys]  # type: ignore
+
+    def _get_backtranslation_key(self, document: str) -> str:
+        """Returns the key used to cache the backtranslation of `document`. On GPU, the MT models run in half
+        precision, which can change their outputs, so the precision is part of the key (as it is for embeddings, see
+        `_get_embedding_key`). This way, results don't depend on which machine filled the cache first.
+        """
+        dtype = torch.float16 if self.device == "cuda" else torch.float32
+        return f"{_BT_FROM_MODEL_NAME}_{_BT_TO_MODEL_NAME}_{dtype}_{util.sanitize_text(document, lowercase=True)}"
+
+    def _backtranslate_sents(self, sents: List[str]) -> List[str]:
+        """Returns back-translated copies of the given `sents`. Sentences are backtranslated in batches of similar
+        length, which keeps padding (and therefore wasted computation) to a minimum.
+        """
+        back_translated_sents = [""] * len(sents)
+        by_length = sorted(range(len(sents)), key=lambda i: len(sents[i]))
+        for batch in more_itertools.chunked(by_length, _BT_BATCH_SIZE):
+            for i, back_translated_sent in zip(batch, self._aug.augment([sents[i] for i in batch])):  # type: ignore
+                back_translated_sents[i] = back_translated_sent
+        return back_translated_sents
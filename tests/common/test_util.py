@@ -28,6 +28,12 @@ def test_sanitize_text(text: str, lowercase: bool) -> None:
         assert all(not char.isupper() for char in sanitized)
 
 
+def test_unflatten() -> None:
+    nested: List[List[str]] = [["a", "b"], [], ["c", "d", "e"], ["f"]]
+    flattened = [item for items in nested for item in items]
+    assert util.unflatten(flattened, lengths=[len(items) for items in nested]) == nested
+
+
 def test_parse_omega_conf() -> None:
     # Simulate command line arguments
     sys.argv = [
@@ -99,6 +105,17 @@ def test_get_num_docs() -> None:
     actual = util.get_num_docs("This is ends with characters from doc_sep_token sep", doc_sep_token=doc_sep_token)
     assert expected == actual
 
+    # Test that already split documents are supported, with or without a doc_sep_token
+    text = f"Document 1 {doc_sep_token} {doc_sep_token} Document 3 {doc_sep_token}"
+    input_docs = util.split_docs(text, doc_sep_token=doc_sep_token)
+    expected = util.get_num_docs(text, doc_sep_token=doc_sep_token)
+    assert expected == util.get_num_docs(input_docs)
+    assert expected == util.get_num_docs(input_docs, doc_sep_token=doc_sep_token)
+
+    # A doc_sep_token is required to split a string
+    with pytest.raises(ValueError):
+        util.get_num_docs(text)
+
 
 def test_get_doc_sep_token(hf_tokenizer: Callable) -> None:
     # A model from the PRIMERA family
@@ -222,6 +239,42 @@ def test_truncate_multi_doc(tokenizer_type: Callable, request) -> None:
     assert expected == actual
 
 
+@pytest.mark.parametrize("tokenizer_type", ["hf_tokenizer", "tiktokenizer"])
+def test_split_and_truncate_multi_doc(tokenizer_type: Callable, request) -> None:
+    max_length = 24
+    doc_sep_token = "\n\n"
+
+    # Retrieve the correct tokenizer
+    tokenizer_factory = request.getfixturevalue(tokenizer_type)
+    tokenizer = (
+        tokenizer_factory("allenai/PRIMERA")
+        if tokenizer_type == "hf_tokenizer"
+        else tokenizer_factory("gpt-3.5-turbo")
+    )
+
+    docs = [
+        "I am document one. I am the same length as document two",
+        "I am document two. I am the same length as document one.",
+    ]
+    text = f" {doc_sep_token} ".join(docs)
+
+    # Documents should be returned individually, without any doc_sep_token's
+    expected = (
+        ["I am document one. I am the same", "I am document two. I am the same"]
+        if tokenizer_type == "hf_tokenizer"
+        else ["I am document one. I am the same length as", "I am document two. I am the same length as"]
+    )
+    actual = util.split_and_truncate_multi_doc(
+        text, doc_sep_token=doc_sep_token, max_length=max_length, tokenizer=tokenizer
+    )
+    assert expected == actual
+
+    # Documents should be returned as is if no truncation is needed
+    expected = util.split_docs(text, doc_sep_token=doc_sep_token)
+    actual = util.split_and_truncate_multi_doc(text, doc_sep_token=doc_sep_token, max_length=512, tokenizer=tokenizer)
+    assert expected == actual
+
+
 def test_batch_decode_multi_doc() -> None:
     # A tokenizer with both bos and eos tokens
     tokenizer = AutoTokenizer.from_pretrained("allenai/PRIMERA")
@@ -15,6 +15,14 @@ def test_sanitize_query() -> None:
     assert actual["query"].iloc[0] != topics["query"].iloc[0]
 
 
+def test_group_retrieved_by_qid() -> None:
+    retrieved = pd.DataFrame({"qid": ["q2", "q1", "q2", "q1"], "docno": ["d3", "d1", "d4", "d2"]})
+    expected = {"q2": ["d3", "d4"], "q1": ["d1", "d2"]}
+    actual = indexing.group_retrieved_by_qid(retrieved)
+    # The rank order of docnos for each qid should be preserved
+    assert actual == expected
+
+
 class TestCanonicalMDSDataset:
     def test_info_url(self, canonical_mds_pt_dataset: indexing.HuggingFacePyTerrierDataset):
         assert (
@@ -28,7 +36,7 @@ class TestCanonicalMDSDataset:
         qid = f"{split}_{idx}"
 
         # Create dummy retrieval results
-        retrieved = pd.DataFrame({"qid": [qid], "docno": ["validation_0_0"]})
+        retrieved = indexing.group_retrieved_by_qid(pd.DataFrame({"qid": [qid], "docno": ["validation_0_0"]}))
         expected_document = canonical_mds_pt_dataset._hf_dataset["validation"][0]["document"].split(
             canonical_mds_pt_dataset._doc_sep_token
         )[0]
@@ -51,6 +59,30 @@ class TestCanonicalMDSDataset:
         actual = canonical_mds_pt_dataset.replace(deepcopy(example), idx, split=split, retrieved=retrieved, k=1)
         assert actual == example
 
+    def test_replace_batched(self, canonical_mds_pt_dataset: indexing.HuggingFacePyTerrierDataset) -> None:
+        split = "train"
+        indices = [0, 1]
+
+        # Create dummy retrieval results
+        retrieved = indexing.group_retrieved_by_qid(
+            pd.DataFrame({"qid": [f"{split}_{idx}" for idx in indices], "docno": ["validation_0_0", "validation_0_1"]})
+        )
+        expected_documents = canonical_mds_pt_dataset._hf_dataset["validation"][0]["document"].split(
+            canonical_mds_pt_dataset._doc_sep_token
+        )[:2]
+
+        # Check that each example in the batch is modified as expected
+        examples = {
+            "document": ["This can be anything", "This can also be anything"],
+            "summary": ["This could be anything", "This could also be anything"],
+        }
+        actual = canonical_mds_pt_dataset.replace_batched(
+            deepcopy(examples), indices, split=split, retrieved=retrieved, k=1
+        )
+        assert [doc.strip() for doc in actual["document"]] == [doc.strip() for doc in expected_documents]
+        # Check that the target summaries are not modified
+        assert actual["summary"] == examples["summary"]
+
     def test_get_corpus_iter(self, canonical_mds_pt_dataset: indexing.HuggingFacePyTerrierDataset) -> None:
         expected_docno = "train_0_0"
         expected_text = util.split_docs(
@@ -109,7 +141,7 @@ class TestMultiXScienceDataset:
         # Create dummy retrieval results
         expected_docno = multxscience_pt_dataset._hf_dataset["validation"][0]["ref_abstract"]["mid"][0]
         expected_document = multxscience_pt_dataset._hf_dataset["validation"][0]["ref_abstract"]["abstract"][0]
-        retrieved = pd.DataFrame({"qid": [qid], "docno": [expected_docno]})
+        retrieved = indexing.group_retrieved_by_qid(pd.DataFrame({"qid": [qid], "docno": [expected_docno]}))
 
         # Check that the example is modified as expected
         example = {
@@ -174,7 +206,7 @@ class TestMSLR2022MS2Dataset:
         expected_docno = ms2_pt_dataset._hf_dataset["validation"][0]["pmid"][0]
         expected_title = ms2_pt_dataset._hf_dataset["validation"][0]["title"][0]
         expected_abstract = ms2_pt_dataset._hf_dataset["validation"][0]["abstract"][0]
-        retrieved = pd.DataFrame({"qid": [qid], "docno": [expected_docno]})
+        retrieved = indexing.group_retrieved_by_qid(pd.DataFrame({"qid": [qid], "docno": [expected_docno]}))
 
         # Check that the example is modified as expected
         example = {
@@ -251,7 +283,7 @@ class TestMSLR2022CochraneDataset:
         expected_docno = cochrane_pt_dataset._hf_dataset["validation"][0]["pmid"][0]
         expected_title = cochrane_pt_dataset._hf_dataset["validation"][0]["title"][0]
         expected_abstract = cochrane_pt_dataset._hf_dataset["validation"][0]["abstract"][0]
-        retrieved = pd.DataFrame({"qid": [qid], "docno": [expected_docno]})
+        retrieved = indexing.group_retrieved_by_qid(pd.DataFrame({"qid": [qid], "docno": [expected_docno]}))
 
         # Check that the example is modified as expected
         example = {
@@ -1,15 +1,38 @@
 import copy
 import math
+import pickle
 import random
 import warnings
 
 import pytest
 import requests
+import torch
+from diskcache import Cache
 
 from open_mds import perturbations
 from open_mds.common import util
 
 
+def test_chunk_by_size() -> None:
+    assert perturbations._chunk_by_size([], max_size=4) == []
+    assert perturbations._chunk_by_size([1, 2, 1, 3, 6, 1], max_size=4) == [(0, 3), (3, 4), (4, 5), (5, 6)]
+
+
+def test_replace_docs() -> None:
+    documents = ["A", "B", "A"]
+    # Every occurrence of a duplicated document should be replaced, in order
+    assert perturbations._replace_docs(documents, ["A", "B", "A"], ["a1", "b", "a2"]) == ["a1", "b", "a2"]
+    assert perturbations._replace_docs(documents, ["A"], ["a"]) == ["a", "B", "A"]
+    # The input should not be modified
+    assert documents == ["A", "B", "A"]
+
+
+def test_get_doc_indices() -> None:
+    documents = ["document 1", "document 2", "document 1", "document 3"]
+    actual = perturbations._get_doc_indices(documents)
+    assert actual == {doc: documents.index(doc) for doc in documents}
+
+
 class TestPerturber:
     @pytest.mark.parametrize("strategy", ["random", "oracle"])
     def test_invalid_perturbation(self, strategy: str) -> None:
@@ -224,6 +247,45 @@ class TestPerturber:
         assert len(sampled_docs) == 2
         assert all(doc.strip() in expected for doc in sampled_docs)
 
+    def test_get_doc_embeddings(self) -> None:
+        documents = [
+            "A mitochondrion is a double-membrane-bound organelle found in most eukaryotic organisms",
+            "Gaga's five succeeding studio albums all debuted atop the US Billboard 200.",
+            # We duplicate this to check it gets the same embedding
+            "A mitochondrion is a double-membrane-bound organelle found in most eukaryotic organisms",
+        ]
+        perturber = perturbations.Perturber("sorting", doc_sep_token="<doc-sep>", strategy="oracle")
+
+        expected = perturber._embedder.encode(  # type: ignore
+            documents, convert_to_tensor=True, device=perturber.device, normalize_embeddings=True
+        )
+        actual = perturber._get_doc_embeddings(documents)
+        assert actual.shape == expected.shape
+        assert torch.allclose(actual, expected, atol=1e-5)
+        # Embeddings should be indexed by content, so duplicate documents share an entry
+        keys = [perturber._get_embedding_key(doc) for doc in documents]
+        assert keys[0] == keys[2] and keys[0] != keys[1]
+        assert all(key in perturber._index for key in keys)
+        # The index should be shared across instances
+        other = perturbations.Perturber("deletion", doc_sep_token="<doc-sep>", strategy="oracle")
+        assert all(key in other._index for key in keys)
+        # Each cached embedding should only store its own row, not the whole batch it was computed in
+        with Cache(perturbations._EMBEDDINGS_CACHE_DIR) as reference:
+            for key in keys:
+                cached = reference[key]
+                assert cached.shape == expected.shape[1:]
+                assert len(pickle.dumps(cached)) == len(pickle.dumps(cached.clone()))
+
+        # Embeddings should be retrieved from the index on subsequent calls
+        actual = perturber._get_doc_embeddings(documents[::-1])
+        assert torch.allclose(actual, expected.flip(0), atol=1e-5)
+
+    @pytest.mark.skipif(not torch.cuda.is_available(), reason="requires a GPU")
+    def test_backtranslation_half_precision(self) -> None:
+        perturber = perturbations.Perturber("backtranslation", doc_sep_token="<doc-sep>", strategy="random")
+        assert perturber._aug.model.src_model.dtype == torch.float16  # type: ignore
+        assert perturber._aug.model.tgt_model.dtype == torch.float16  # type: ignore
+
     def test_backtranslation(self) -> None:
         # Use a lesser number of documents because the translation is slow
         num_docs = 4